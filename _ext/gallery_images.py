@@ -0,0 +1,258 @@
+# coding: utf-8
+"""
+Parallel, size-optimized figure output for the sphinx-gallery build.
+
+`FigureWriter` replaces sphinx-gallery's matplotlib image scraper. Each figure
+is rendered in the build process (matplotlib is not thread safe) to a quickly
+compressed PNG, and the slow part, compressing its pixels as tightly as
+possible, runs on a thread pool while the example carries on. Pillow releases
+the GIL while encoding, so figures are encoded in parallel.
+
+Figures are written either as losslessly optimized PNG (no alpha channel if
+the figure is opaque, maximum deflate effort) or as lossless WebP. A figure
+whose pixels and output settings have not changed since the last build is not
+encoded again. sphinx-gallery still makes the thumbnails itself, one at a
+time; they are then re-encoded the same way, in parallel, before Sphinx reads
+the generated pages.
+
+Loading this module as a Sphinx extension adds the thumbnail pass and logs the
+bytes saved and the time spent encoding at the end of the build.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import matplotlib.pyplot as plt
+from PIL import Image
+from sphinx.util import logging
+
+from gallery_limits import gallery_output_dir
+
+__all__ = ['FigureWriter']
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = '.image_hashes.json'
+
+
+def _encode(image, path, fmt):
+    """Write ``image`` to ``path`` and return its size in bytes."""
+    if image.mode == 'RGBA' and image.getextrema()[3] == (255, 255):
+        image = image.convert('RGB')
+    # sphinx-gallery may read the file (to make a thumbnail) while it is being
+    # optimized, so only ever replace it with a complete one.
+    tmp = path + '.tmp'
+    if fmt == 'webp':
+        image.save(tmp, 'WEBP', lossless=True, quality=100, method=6)
+    else:
+        image.save(tmp, 'PNG', optimize=True)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+class FigureWriter:
+    """
+    sphinx-gallery image scraper that encodes figures on a thread pool.
+
+    sphinx-gallery expects every figure file to exist as soon as the scraper
+    returns, so a quickly compressed PNG is written straight away and replaced
+    by the optimized file once the pool gets to it.
+
+    Parameters
+    ----------
+    dpi : float, optional
+        Resolution figures are saved at. Defaults to matplotlib's
+        ``savefig.dpi``.
+    format : {'png', 'webp'}, optional
+        Image format of the figures shown on the example pages. With
+        ``'webp'`` the quickly compressed PNG is kept for sphinx-gallery to
+        make the thumbnail from; it is not referenced from the pages, so it
+        is not copied to the HTML output.
+    workers : int, optional
+        Number of encoding threads. Defaults to the number of CPUs.
+    """
+    def __init__(self, dpi=None, format='png', workers=None):
+        if format not in ('png', 'webp'):
+            raise ValueError("format must be 'png' or 'webp', not {0!r}".format(format))
+        self.dpi = dpi
+        self.format = format
+        self.workers = workers or os.cpu_count()
+        self._pool = None
+        self._pending = []
+        self._hashes = None
+        self._lock = threading.Lock()
+        self.stats = {'encoded': 0, 'skipped': 0, 'bytes': 0, 'baseline_bytes': 0,
+                      'encode_time': 0.0, 'wait_time': 0.0}
+
+    def __repr__(self):
+        return 'FigureWriter(dpi={0!r}, format={1!r})'.format(self.dpi, self.format)
+
+    def __getstate__(self):
+        # Sphinx pickles the configuration with the environment; only the
+        # settings are worth keeping, the pool and lock cannot be pickled.
+        return {'dpi': self.dpi, 'format': self.format, 'workers': self.workers}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='gallery-images')
+        return self._pool
+
+    def _load_hashes(self, gallery_conf):
+        if self._hashes is None:
+            self._output_dir = gallery_output_dir(gallery_conf)
+            self._cache_file = os.path.join(self._output_dir, 'images', CACHE_NAME)
+            try:
+                with open(self._cache_file) as fobj:
+                    self._hashes = json.load(fobj)
+            except (OSError, ValueError):
+                self._hashes = {}
+        return self._hashes
+
+    def _key(self, path):
+        # Relative, so that the cache survives the checkout being moved.
+        return os.path.relpath(path, self._output_dir).replace(os.sep, '/')
+
+    def _save_hashes(self):
+        if self._hashes is not None:
+            os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+            with open(self._cache_file, 'w') as fobj:
+                json.dump(self._hashes, fobj, indent=0, sort_keys=True)
+
+    def _submit(self, image, path, fmt, digest, baseline):
+        def job():
+            t0 = time.thread_time()
+            written = _encode(image, path, fmt)
+            with self._lock:
+                self.stats['encoded'] += 1
+                self.stats['bytes'] += written
+                self.stats['baseline_bytes'] += baseline
+                self.stats['encode_time'] += time.thread_time() - t0
+                self._hashes[self._key(path)] = digest
+        self._pending.append(self.pool.submit(job))
+
+    def __call__(self, block, block_vars, gallery_conf):
+        """Save the open matplotlib figures, like sphinx-gallery's ``matplotlib_scraper``."""
+        from sphinx_gallery.scrapers import figure_rst
+
+        hashes = self._load_hashes(gallery_conf)
+        image_paths = []
+        for fig, png_path in zip([plt.figure(num) for num in plt.get_fignums()],
+                                 block_vars['image_path_iterator']):
+            # A PNG rather than raw pixels, so that the image size is known
+            # whatever savefig.bbox crops the figure to.
+            quick = io.BytesIO()
+            fig.savefig(quick, format='png', dpi=self.dpi, facecolor=fig.get_facecolor(),
+                        edgecolor=fig.get_edgecolor(), pil_kwargs={'compress_level': 1})
+            quick = quick.getvalue()
+            with Image.open(io.BytesIO(quick)) as image:
+                image.load()
+            digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+            digest.update(repr((image.mode, image.size, self.format)).encode())
+            digest = digest.hexdigest()
+
+            path = png_path
+            if self.format == 'webp':
+                path = os.path.splitext(png_path)[0] + '.webp'
+            if hashes.get(self._key(path)) == digest and os.path.exists(path) and os.path.exists(png_path):
+                self.stats['skipped'] += 1
+            else:
+                with open(png_path, 'wb') as fobj:
+                    fobj.write(quick)
+                self._submit(image, path, self.format, digest, len(quick))
+            image_paths.append(path)
+        plt.close('all')
+        return figure_rst(image_paths, gallery_conf['src_dir'])
+
+    def flush(self, gallery_conf, fname, when):
+        """``reset_modules`` hook: wait for the figures of an example to be written."""
+        if when != 'after' or not self._pending:
+            return
+        t0 = time.perf_counter()
+        pending, self._pending = self._pending, []
+        for future in wait(pending).done:
+            future.result()
+        self.stats['wait_time'] += time.perf_counter() - t0
+        self._save_hashes()
+
+    def optimize_thumbnails(self, gallery_conf):
+        """Losslessly optimize the thumbnails sphinx-gallery made, in parallel."""
+        hashes = self._load_hashes(gallery_conf)
+        thumb_dir = os.path.join(gallery_output_dir(gallery_conf), 'images', 'thumb')
+        if not os.path.isdir(thumb_dir):
+            return
+        for name in sorted(os.listdir(thumb_dir)):
+            path = os.path.join(thumb_dir, name)
+            if not name.endswith('.png'):
+                continue
+            with open(path, 'rb') as fobj:
+                digest = hashlib.blake2b(fobj.read(), digest_size=16).hexdigest()
+            if hashes.get(self._key(path)) == digest:
+                # Already optimized by a previous build and not rewritten since.
+                self.stats['skipped'] += 1
+                continue
+            with Image.open(path) as thumb:
+                thumb.load()
+                image = thumb.convert('RGBA')
+
+            def job(image=image, path=path):
+                t0 = time.thread_time()
+                baseline = os.path.getsize(path)
+                written = _encode(image, path, 'png')
+                with open(path, 'rb') as fobj:
+                    digest = hashlib.blake2b(fobj.read(), digest_size=16).hexdigest()
+                with self._lock:
+                    self.stats['encoded'] += 1
+                    self.stats['bytes'] += written
+                    self.stats['baseline_bytes'] += baseline
+                    self.stats['encode_time'] += time.thread_time() - t0
+                    self._hashes[self._key(path)] = digest
+            self._pending.append(self.pool.submit(job))
+        self.flush(gallery_conf, None, 'after')
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def report(self):
+        stats = self.stats
+        logger.info('gallery images: %d encoded, %d unchanged; %.1f MiB written instead of '
+                    '%.1f MiB before optimizing (%.1f MiB saved); %.1f s encoding on '
+                    '%d threads, %.1f s waited',
+                    stats['encoded'], stats['skipped'], stats['bytes'] / 1024**2,
+                    stats['baseline_bytes'] / 1024**2,
+                    (stats['baseline_bytes'] - stats['bytes']) / 1024**2,
+                    stats['encode_time'], self.workers, stats['wait_time'])
+
+
+# -- Sphinx extension ---------------------------------------------------------
+
+def _find_writer(config):
+    for scraper in config.sphinx_gallery_conf.get('image_scrapers', ()):
+        if isinstance(scraper, FigureWriter):
+            return scraper
+    return None
+
+
+def finish_images(app, env, docnames):
+    """Optimize thumbnails once the gallery has been generated, then report."""
+    writer = _find_writer(app.config)
+    if writer is None:
+        return
+    gallery_conf = dict(app.config.sphinx_gallery_conf, src_dir=app.srcdir)
+    writer.optimize_thumbnails(gallery_conf)
+    writer.close()
+    writer.report()
+
+
+def setup(app):
+    app.connect('env-before-read-docs', finish_images)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
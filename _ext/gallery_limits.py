@@ -0,0 +1,274 @@
+# coding: utf-8
+"""
+Per-example resource budgets for the sphinx-gallery build.
+
+sphinx-gallery executes every example inside the Sphinx process, so a single
+example stuck on a slow server (or allocating without bound) can stall the
+whole build. `ExampleLimits` is used as a ``reset_modules`` callable: before an
+example runs it arms a wall-clock timer and lowers the CPU and address-space
+soft limits of the process, and afterwards it restores them.
+
+When a budget is exceeded the example gets an `ExampleLimitExceeded` (or a
+`MemoryError` from the allocator), which sphinx-gallery renders as a failed
+example before carrying on with the next file. An example that catches the
+exception and keeps running gets it again every second, and after a short
+grace period an `ExampleLimitAbort`, which is not an `Exception` and stops the
+build rather than letting it hang. A summary of every executed example is
+written next to the generated gallery as ``sg_resource_limits.rst``.
+"""
+import math
+import os
+import signal
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from sphinx.util import logging
+
+__all__ = ['ExampleLimits', 'ExampleLimitExceeded', 'ExampleLimitAbort']
+
+logger = logging.getLogger(__name__)
+
+# The logger sphinx-gallery reports failing examples on.
+_GALLERY_LOG = logging.getLogger('sphinx-gallery').logger
+
+REPORT_NAME = 'sg_resource_limits.rst'
+
+# Once a budget has been exceeded, keep interrupting the example at this
+# interval (seconds) in case it swallowed the first exception.
+_REPEAT = 1.0
+
+# Seconds an example may keep running after it was first interrupted before
+# the build is aborted.
+_GRACE = 10 * _REPEAT
+
+
+class ExampleLimitExceeded(RuntimeError):
+    """Raised inside an example that ran over one of its budgets."""
+
+
+class ExampleLimitAbort(BaseException):
+    """
+    Raised inside an example that kept running after `ExampleLimitExceeded`.
+
+    Deliberately not an `Exception`, so that neither the example's own
+    ``except Exception`` nor sphinx-gallery catches it, and the build stops.
+    """
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _address_space():
+    """Current virtual memory size of this process in bytes, if known."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _format_bytes(nbytes):
+    return '{0:.1f} GiB'.format(nbytes / 1024**3)
+
+
+class ExampleLimits:
+    """
+    Wall-clock, CPU and address-space budgets for gallery examples.
+
+    Parameters
+    ----------
+    wall_time : float, optional
+        Wall-clock seconds an example may run for.
+    cpu_time : float, optional
+        CPU seconds (user + system) an example may use.
+    memory : int, optional
+        Bytes of address space an example may add to the build process.
+    per_file : dict, optional
+        Maps example file names (e.g. ``'retrieve_compress.py'``) to a dict
+        of the keyword arguments above, overriding the global budgets for
+        that file. A value of `None` disables that budget.
+
+    Any budget left as `None` is not enforced.
+    """
+    def __init__(self, wall_time=None, cpu_time=None, memory=None, per_file=None):
+        self.defaults = {'wall_time': wall_time, 'cpu_time': cpu_time, 'memory': memory}
+        self.per_file = dict(per_file or {})
+        self.records = {}
+        self._reset_state()
+
+    def __repr__(self):
+        # sphinx-gallery compares the repr of reset_modules entries to decide
+        # whether the gallery configuration changed between builds.
+        return 'ExampleLimits({0!r}, per_file={1!r})'.format(self.defaults, self.per_file)
+
+    def limits_for(self, fname):
+        """Return the budgets that apply to the example ``fname``."""
+        limits = dict(self.defaults)
+        limits.update(self.per_file.get(os.path.basename(fname), {}))
+        return limits
+
+    def __call__(self, gallery_conf, fname, when):
+        if when == 'before':
+            self._arm(fname)
+        else:
+            self._disarm(gallery_conf, fname)
+
+    def _reset_state(self):
+        self._current = None
+        self._exceeded = None
+        self._exceeded_at = None
+        self._failure = None
+        self._started = None
+        self._cpu_started = None
+        self._saved = {}
+
+    def _arm(self, fname):
+        self._reset_state()
+        self._current = os.path.basename(fname)
+        self._limits = self.limits_for(fname)
+        self._started = time.perf_counter()
+        main_thread = threading.current_thread() is threading.main_thread()
+        # sphinx-gallery only records a failing example after the "after"
+        # hook has run, but logs its traceback while the example is still
+        # armed, so watch the log to tell whether the example was stopped.
+        _GALLERY_LOG.addFilter(self._watch_failure)
+
+        wall_time = self._limits['wall_time']
+        if wall_time and main_thread and hasattr(signal, 'SIGALRM'):
+            self._saved['SIGALRM'] = signal.signal(signal.SIGALRM, self._on_signal)
+            signal.setitimer(signal.ITIMER_REAL, wall_time, _REPEAT)
+
+        if resource is None:
+            return
+        self._cpu_started = _cpu_seconds()
+
+        cpu_time = self._limits['cpu_time']
+        if cpu_time and main_thread and hasattr(signal, 'SIGXCPU'):
+            soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            limit = math.ceil(self._cpu_started + cpu_time)
+            if hard == resource.RLIM_INFINITY or limit < hard:
+                self._saved['SIGXCPU'] = signal.signal(signal.SIGXCPU, self._on_signal)
+                self._saved['RLIMIT_CPU'] = (soft, hard)
+                resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+        memory = self._limits['memory']
+        in_use = _address_space()
+        if memory and in_use is not None:
+            soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+            limit = in_use + memory
+            if hard == resource.RLIM_INFINITY or limit < hard:
+                self._saved['RLIMIT_AS'] = (soft, hard)
+                resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+    def _restore(self):
+        """Lift the limits and stop watching the log."""
+        if 'RLIMIT_AS' in self._saved:
+            resource.setrlimit(resource.RLIMIT_AS, self._saved['RLIMIT_AS'])
+        if 'SIGALRM' in self._saved:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._saved['SIGALRM'])
+        if 'RLIMIT_CPU' in self._saved:
+            resource.setrlimit(resource.RLIMIT_CPU, self._saved['RLIMIT_CPU'])
+            signal.signal(signal.SIGXCPU, self._saved['SIGXCPU'])
+        self._saved = {}
+        _GALLERY_LOG.removeFilter(self._watch_failure)
+
+    def _disarm(self, gallery_conf, fname):
+        if self._current != os.path.basename(fname):
+            # "after" without a matching "before"; nothing was armed.
+            return
+        # Lift the limits first so that reporting cannot trip over them.
+        self._restore()
+
+        wall = time.perf_counter() - self._started
+        cpu = _cpu_seconds() - self._cpu_started if self._cpu_started is not None else None
+        status = self._exceeded
+        if status is None and self._limits['memory'] and 'MemoryError' in (self._failure or ''):
+            status = 'memory limit ({0})'.format(_format_bytes(self._limits['memory']))
+        # Only an example that sphinx-gallery reported as failing was stopped;
+        # one that caught the exception and finished within the grace period
+        # merely ran over.
+        killed = status is not None and self._failure is not None
+        if killed:
+            logger.info('sphinx-gallery: %s was stopped after exceeding its %s',
+                        self._current, status)
+        elif status is not None:
+            logger.warning('sphinx-gallery: %s exceeded its %s but caught the exception '
+                           'and kept running', self._current, status)
+        self.records[self._current] = (wall, cpu, status, killed)
+        self._reset_state()
+        self._write_report(gallery_conf)
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGXCPU:
+            reason = 'CPU time limit ({0:g} s)'.format(self._limits['cpu_time'])
+        else:
+            reason = 'wall-clock limit ({0:g} s)'.format(self._limits['wall_time'])
+        # Only interrupt the example itself, never sphinx-gallery's own
+        # bookkeeping once the example has already been stopped.
+        while frame is not None:
+            if os.path.basename(frame.f_code.co_filename) == self._current:
+                self._exceeded = self._exceeded or reason
+                now = time.perf_counter()
+                if self._exceeded_at is None:
+                    self._exceeded_at = now
+                elif now - self._exceeded_at >= _GRACE:
+                    # The example keeps swallowing ExampleLimitExceeded.
+                    self._restore()
+                    raise ExampleLimitAbort(
+                        '{0} exceeded its {1} and was still running {2:g} s later; '
+                        'aborting the build'.format(self._current, self._exceeded, _GRACE))
+                raise ExampleLimitExceeded('{0} exceeded its {1}'.format(self._current, reason))
+            frame = frame.f_back
+
+    def _watch_failure(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            return True
+        if self._current and self._current in message and 'failed to execute' in message:
+            self._failure = message
+        return True
+
+    def _write_report(self, gallery_conf):
+        report = os.path.join(gallery_output_dir(gallery_conf), REPORT_NAME)
+
+        rows = []
+        for name, (wall, cpu, status, killed) in sorted(self.records.items()):
+            cpu = '--' if cpu is None else '{0:.2f}'.format(cpu)
+            if status is not None:
+                status = ('killed: ' if killed else 'over budget, not stopped: ') + status
+            else:
+                status = 'ok'
+            rows.append(('``{0}``'.format(name), '{0:.2f}'.format(wall), cpu, status))
+        header = ('Example', 'Wall (s)', 'CPU (s)', 'Status')
+        widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+        rule = '  '.join('=' * width for width in widths)
+
+        lines = [':orphan:', '', '.. _sphx_glr_resource_limits:', '',
+                 'Example resource usage', '======================', '',
+                 rule, '  '.join(h.ljust(w) for h, w in zip(header, widths)), rule]
+        lines += ['  '.join(c.ljust(w) for c, w in zip(row, widths)) for row in rows]
+        lines += [rule, '']
+        os.makedirs(os.path.dirname(report), exist_ok=True)
+        with open(report, 'w') as fobj:
+            fobj.write('\n'.join(lines))
+
+
+def gallery_output_dir(gallery_conf):
+    """Absolute path of the (first) generated gallery directory."""
+    gallery_dirs = gallery_conf['gallery_dirs']
+    if not isinstance(gallery_dirs, (list, tuple)):
+        gallery_dirs = [gallery_dirs]
+    return os.path.join(gallery_conf['src_dir'], gallery_dirs[0])
+
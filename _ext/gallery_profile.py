@@ -0,0 +1,340 @@
+# coding: utf-8
+"""
+Opt-in sampling profiler for the sphinx-gallery build.
+
+`ExampleProfiler` is used as a ``reset_modules`` callable. While an example
+runs, a background thread samples the Python stack of the main thread every
+few milliseconds. Each sample is weighted by the wall-clock time since the
+previous one: while the example holds the GIL in compiled code the sampler
+cannot run, and the whole call is then credited to the Python function that
+made it. For each example it writes, next to the generated gallery in
+``profiles/``:
+
+* ``<example>.collapsed``: the samples as collapsed stacks (one
+  ``frame;frame;frame microseconds`` line per unique stack), the format read
+  by ``flamegraph.pl``, speedscope and most other flame graph tools;
+* ``<example>.svg``: a self-contained flame graph, hover a frame for its
+  time and click it to zoom.
+
+Loading this module as a Sphinx extension links both files from the rendered
+page of each profiled example, and writes ``sg_profile_summary.rst`` with the
+hottest functions over the whole gallery.
+
+Only examples that are executed during the build are profiled, so profile from
+a clean build (e.g. ``GALLERY_PROFILE=1 tox -r``).
+"""
+import html
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+from gallery_limits import gallery_output_dir
+
+__all__ = ['ExampleProfiler', 'render_flamegraph']
+
+PROFILE_DIR = 'profiles'
+SUMMARY_NAME = 'sg_profile_summary.rst'
+
+
+def _frame_label(code):
+    name = getattr(code, 'co_qualname', code.co_name)
+    label = '{0} ({1}:{2})'.format(name, os.path.basename(code.co_filename),
+                                   code.co_firstlineno)
+    # ";" separates frames in the collapsed format.
+    return label.replace(';', ':')
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the stack of ``thread_id`` every ``interval`` seconds.
+
+    ``stacks`` maps each stack to the wall-clock seconds it was sampled for.
+    """
+    def __init__(self, thread_id, example, interval):
+        super().__init__(name='gallery-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.example = example
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            # The wait can take much longer than ``interval`` when the main
+            # thread holds the GIL, so weight the sample by the actual time.
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            # Drop the Sphinx and sphinx-gallery frames below the example;
+            # samples taken outside the example are not attributed to it.
+            for root, code in enumerate(reversed(codes)):
+                if os.path.basename(code.co_filename) == self.example:
+                    break
+            else:
+                continue
+            codes = codes[:len(codes) - root]
+            self.stacks[';'.join(_frame_label(code) for code in reversed(codes))] += elapsed
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ExampleProfiler:
+    """
+    Profile every executed gallery example with a sampling profiler.
+
+    Parameters
+    ----------
+    interval : float, optional
+        Seconds between stack samples.
+    top : int, optional
+        Number of functions listed in the gallery-wide summary.
+    """
+    def __init__(self, interval=0.005, top=25):
+        self.interval = interval
+        self.top = top
+        # Maps example file name to (collapsed stacks, number of samples,
+        # wall-clock seconds).
+        self.profiles = {}
+        self._sampler = None
+        self._started = None
+
+    def __repr__(self):
+        return 'ExampleProfiler(interval={0!r}, top={1!r})'.format(self.interval, self.top)
+
+    def __call__(self, gallery_conf, fname, when):
+        example = os.path.basename(fname)
+        if when == 'before':
+            self._sampler = _Sampler(threading.get_ident(), example, self.interval)
+            self._started = time.perf_counter()
+            self._sampler.start()
+        elif self._sampler is not None and self._sampler.example == example:
+            self._sampler.stop()
+            self.profiles[example] = (self._sampler.stacks, self._sampler.samples,
+                                      time.perf_counter() - self._started)
+            self._sampler = None
+            self._write_profile(gallery_conf, example)
+            self._write_summary(gallery_conf)
+
+    def _write_profile(self, gallery_conf, example):
+        stacks = self.profiles[example][0]
+        out_dir = os.path.join(gallery_output_dir(gallery_conf), PROFILE_DIR)
+        os.makedirs(out_dir, exist_ok=True)
+        stem = os.path.splitext(example)[0]
+        with open(os.path.join(out_dir, stem + '.collapsed'), 'w') as fobj:
+            for stack, seconds in sorted(stacks.items()):
+                fobj.write('{0} {1}\n'.format(stack, round(seconds * 1e6)))
+        with open(os.path.join(out_dir, stem + '.svg'), 'w') as fobj:
+            fobj.write(render_flamegraph(stacks, title=example))
+
+    def hot_functions(self):
+        """
+        Return the functions with the most time over all profiled examples.
+
+        Returns
+        -------
+        list of tuple
+            ``(function, self seconds, total seconds, examples)``, ordered by
+            total then self time. A sample counts towards a function's total
+            if the function is anywhere on the stack, and towards its self
+            time only if it was the innermost Python frame (time in compiled
+            code is credited to the Python function that called it).
+        """
+        self_time = Counter()
+        total_time = Counter()
+        examples = {}
+        for example, (stacks, _, _) in self.profiles.items():
+            for stack, seconds in stacks.items():
+                frames = stack.split(';')
+                self_time[frames[-1]] += seconds
+                for frame in set(frames):
+                    total_time[frame] += seconds
+                    examples.setdefault(frame, set()).add(example)
+        ranked = sorted(total_time, key=lambda f: (-total_time[f], -self_time[f], f))
+        return [(f, self_time[f], total_time[f], sorted(examples[f]))
+                for f in ranked[:self.top]]
+
+    def _write_summary(self, gallery_conf):
+        # Functions called from the top level of an example are on every one
+        # of its stacks; they are still useful for comparing examples.
+        rows = []
+        for function, self_time, total_time, examples in self.hot_functions():
+            rows.append(['``{0}``'.format(function),
+                         '{0:.2f}'.format(self_time),
+                         '{0:.2f}'.format(total_time),
+                         ', '.join(os.path.splitext(e)[0] for e in examples)])
+        header = ['Function', 'Self (s, estimated)', 'Total (s, estimated)', 'Examples']
+        lines = [':orphan:', '', '.. _sphx_glr_profile_summary:', '',
+                 'Hot functions', '=============', '',
+                 'Estimated from stack samples taken about every {0:g} ms while the '
+                 'examples ran, each weighted by the time since the previous sample.'.format(
+                     self.interval * 1000), '',
+                 '.. list-table::', '   :header-rows: 1', '']
+        for row in [header] + rows:
+            lines.append('   * - ' + row[0])
+            lines.extend('     - ' + cell for cell in row[1:])
+        lines.append('')
+        with open(os.path.join(gallery_output_dir(gallery_conf), SUMMARY_NAME), 'w') as fobj:
+            fobj.write('\n'.join(lines))
+
+
+# -- Flame graph rendering ----------------------------------------------------
+
+_WIDTH = 1200
+_FRAME_HEIGHT = 16
+_FONT_SIZE = 12
+_MARGIN = 10
+_TITLE_HEIGHT = 30
+
+_SCRIPT = """
+var frames = document.querySelectorAll('g.frame');
+var total = {total};
+function zoom(x0, w0, d0) {{
+  frames.forEach(function (g) {{
+    var x = +g.dataset.x, w = +g.dataset.w, d = +g.dataset.d;
+    var rect = g.querySelector('rect'), text = g.querySelector('text');
+    var inside = x >= x0 && x + w <= x0 + w0;
+    var below = d < d0 && x <= x0 && x + w >= x0 + w0;
+    if (!inside && !below) {{ g.style.display = 'none'; return; }}
+    g.style.display = '';
+    var px = inside ? (x - x0) / w0 * {width} : 0;
+    var pw = inside ? w / w0 * {width} : {width};
+    rect.setAttribute('x', px + {margin});
+    rect.setAttribute('width', Math.max(pw - 1, 0.5));
+    text.setAttribute('x', px + {margin} + 3);
+    var chars = Math.floor((pw - 6) / 7);
+    var name = g.dataset.name;
+    text.textContent = chars < 3 ? '' : (name.length > chars ? name.slice(0, chars - 2) + '..' : name);
+  }});
+}}
+frames.forEach(function (g) {{
+  g.addEventListener('click', function () {{ zoom(+g.dataset.x, +g.dataset.w, +g.dataset.d); }});
+}});
+document.querySelector('#reset').addEventListener('click', function () {{ zoom(0, total, 0); }});
+zoom(0, total, 0);
+"""
+
+
+def _color(name):
+    # Deterministic warm colours so rebuilt graphs do not change needlessly.
+    value = zlib.crc32(name.encode('utf-8'))
+    return 'rgb({0},{1},{2})'.format(205 + value % 50, (value >> 8) % 230, (value >> 16) % 55)
+
+
+def render_flamegraph(stacks, title=''):
+    """
+    Render collapsed stacks as a self-contained, zoomable SVG flame graph.
+
+    Parameters
+    ----------
+    stacks : dict
+        Maps ``frame;frame;frame`` strings, outermost frame first, to the
+        seconds spent in them.
+    title : str, optional
+        Title drawn above the graph.
+
+    Returns
+    -------
+    str
+        The SVG document.
+    """
+    # Build a call tree; children are laid out alphabetically, like
+    # flamegraph.pl, so that the same stacks always give the same picture.
+    tree = {'count': 0, 'children': {}}
+    for stack, count in stacks.items():
+        tree['count'] += count
+        node = tree
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'count': 0, 'children': {}})
+            node['count'] += count
+
+    total = tree['count']
+    boxes = []
+
+    def layout(node, x, depth):
+        for name in sorted(node['children']):
+            child = node['children'][name]
+            boxes.append((name, x, child['count'], depth))
+            layout(child, x, depth + 1)
+            x += child['count']
+
+    layout(tree, 0, 0)
+    depth = max((box[3] for box in boxes), default=0) + 1
+    height = _TITLE_HEIGHT + depth * _FRAME_HEIGHT + 2 * _MARGIN
+
+    parts = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" width="{0}" height="{1}" '
+             'viewBox="0 0 {0} {1}" font-family="Verdana, sans-serif" font-size="{2}">'.format(
+                 _WIDTH + 2 * _MARGIN, height, _FONT_SIZE),
+             '<style>g.frame { cursor: pointer; } g.frame:hover rect { stroke: black; }</style>',
+             '<rect width="100%" height="100%" fill="#fdf6ec"/>',
+             '<text x="{0}" y="{1}" font-size="16">{2}</text>'.format(
+                 _MARGIN, _MARGIN + 14, html.escape('{0} ({1:.2f} s)'.format(title, total))),
+             '<text id="reset" x="{0}" y="{1}" text-anchor="end" style="cursor: pointer;">'
+             'Reset zoom</text>'.format(_WIDTH + _MARGIN, _MARGIN + 14)]
+    for name, x, count, level in boxes:
+        y = height - _MARGIN - (level + 1) * _FRAME_HEIGHT
+        label = html.escape(name, quote=True)
+        parts.append(
+            '<g class="frame" data-name="{0}" data-x="{1}" data-w="{2}" data-d="{3}">'
+            '<title>{0} ({9:.3f} s, {4:.1f}%)</title>'
+            '<rect x="0" y="{5}" width="0" height="{6}" fill="{7}" rx="2"/>'
+            '<text x="0" y="{8}"></text></g>'.format(
+                label, x, count, level, 100 * count / total, y, _FRAME_HEIGHT - 1,
+                _color(name), y + _FRAME_HEIGHT - 4, count))
+    parts.append('<script><![CDATA[{0}]]></script>'.format(
+        _SCRIPT.format(total=total or 1, width=_WIDTH, margin=_MARGIN)))
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+
+# -- Sphinx extension ---------------------------------------------------------
+
+def _find_profiler(config):
+    for reset_module in config.sphinx_gallery_conf.get('reset_modules', ()):
+        if isinstance(reset_module, ExampleProfiler):
+            return reset_module
+    return None
+
+
+def link_profile(app, docname, source):
+    """Add flame graph links to the page of each profiled example."""
+    profiler = _find_profiler(app.config)
+    if profiler is None:
+        return
+    gallery_dirs = app.config.sphinx_gallery_conf.get('gallery_dirs')
+    if not isinstance(gallery_dirs, (list, tuple)):
+        gallery_dirs = [gallery_dirs]
+    gallery_dir, _, stem = docname.rpartition('/')
+    if gallery_dir not in gallery_dirs or stem + '.py' not in profiler.profiles:
+        return
+    _, samples, wall = profiler.profiles[stem + '.py']
+    snippet = '\n'.join([
+        '', '.. rubric:: Profile', '',
+        'Sampled about every {0:g} ms while this example ran during the documentation build '
+        '({1} samples over {2:.1f} s): '
+        ':download:`flame graph <{3}/{4}.svg>`, '
+        ':download:`collapsed stacks <{3}/{4}.collapsed>`. '
+        'See also the :ref:`hot functions of the whole gallery <sphx_glr_profile_summary>`.'.format(
+            profiler.interval * 1000, samples, wall, PROFILE_DIR, stem), '', ''])
+    # Keep the links above the download buttons sphinx-gallery puts at the end.
+    marker = '.. _sphx_glr_download_'
+    text = source[0]
+    index = text.find(marker)
+    source[0] = text + snippet if index == -1 else text[:index] + snippet + text[index:]
+
+
+def setup(app):
+    app.connect('source-read', link_profile)
+    return {'parallel_read_safe': True, 'parallel_write_safe': True}
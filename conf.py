@@ -12,10 +12,10 @@
 # add these directories to sys.path here. If the directory is relative to the
 # documentation root, use os.path.abspath to make it absolute, like shown here.
 #
-# import os
-# import sys
-# sys.path.insert(0, os.path.abspath('.'))
+import os
+import sys
 import pathlib
+sys.path.insert(0, os.path.abspath('_ext'))
 
 
 # -- Project information -----------------------------------------------------
@@ -212,12 +212,46 @@ intersphinx_mapping = {
 extensions += ["sphinx_gallery.gen_gallery"]
 path = pathlib.Path.cwd()
 example_dir = path.joinpath('gallery')
+
+# Budgets that keep a single hanging or runaway example from stalling the
+# build. An example that exceeds them is stopped and rendered as failed; see
+# generated/gallery/sg_resource_limits.rst for a summary after the build.
+from gallery_limits import ExampleLimits
+example_limits = ExampleLimits(
+    wall_time=15 * 60,
+    cpu_time=15 * 60,
+    memory=6 * 1024**3,
+    per_file={
+        # The PSF computation alone can take over 16 minutes on a CPU.
+        'retrieve_compress.py': {'wall_time': 60 * 60, 'cpu_time': 60 * 60},
+    })
+
+# Figures are encoded on a thread pool as optimized PNG (or lossless WebP with
+# format='webp'), and figures whose pixels did not change are not re-encoded.
+# Set dpi to trade figure resolution for size.
+from gallery_images import FigureWriter
+figure_writer = FigureWriter(dpi=None, format='png')
+extensions += ['gallery_images']
+
+reset_modules = ('matplotlib', example_limits, figure_writer.flush)
+
+# Opt-in profiling: with GALLERY_PROFILE=1 every executed example is sampled
+# and its page links to a flame graph; the hottest functions of the whole
+# gallery are listed in generated/gallery/sg_profile_summary.rst.
+extensions += ['gallery_profile']
+if os.environ.get('GALLERY_PROFILE', '0') not in ('', '0'):
+    from gallery_profile import ExampleProfiler
+    reset_modules += (ExampleProfiler(),)
+
 sphinx_gallery_conf = {
     'backreferences_dir': path.joinpath('generated', 'modules'),
     'filename_pattern': '^((?!skip_).)*$',
     'examples_dirs': example_dir,
     'gallery_dirs': "generated/gallery",
     'abort_on_example_error': False,
+    'reset_modules': reset_modules,
+    'image_scrapers': (figure_writer,),
+    'reset_modules_order': 'both',
     'plot_gallery': True,
     'binder': {
         'org': 'HeliophysicsPy',
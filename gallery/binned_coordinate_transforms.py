@@ -0,0 +1,187 @@
+# coding: utf-8
+"""
+==================================================
+Converting Long Trajectories to SM and GSM Quickly
+==================================================
+
+The `Transforming Coordinates Between SpacePy, Astropy, and SunPy <https://heliopython.org/gallery/generated/gallery/coordinate_systems.html>`_
+example converts a GEO coordinate to the Solar Magnetic (SM) system with
+`spacepy.coordinates.Coords.convert`. For every time, this works out the
+direction of the Sun and of the geomagnetic dipole axis again, which is most
+of the cost of converting a long trajectory sampled every second. These
+directions change slowly, so the purpose of this example is to show how to
+compute the transformation once per time bin (a minute, say), interpolate it
+to the times in between, and check how much accuracy that costs.
+"""
+
+##############################################################################
+# First the imports
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from spacepy.coordinates import Coords
+import spacepy.time as spt
+
+##############################################################################
+# GEO, GSM and SM are all centred on the Earth, so converting between them is
+# a rotation, and the rotation at a given time can be read off by converting
+# the three GEO unit vectors: the converted vectors are the columns of the
+# rotation matrix. All bin edges are converted in one call to
+# `~spacepy.coordinates.Coords.convert`, so the exact conversion is used, only
+# far less often.
+def rotation_matrices(tai, system):
+    """
+    Rotation matrices from GEO to ``system`` at the given times.
+
+    Parameters
+    ----------
+    tai : `numpy.ndarray`
+        Times as SpacePy TAI, shape ``(n,)``.
+    system : `str`
+        Coordinate system, e.g. ``'SM'`` or ``'GSM'``.
+
+    Returns
+    -------
+    `numpy.ndarray`
+        Shape ``(n, 3, 3)``.
+    """
+    n = len(tai)
+    basis = Coords(np.tile(np.eye(3), (n, 1)), 'GEO', 'car',
+                   ticks=spt.Ticktock(np.repeat(tai, 3), 'TAI'))
+    # Row j of each block of three is the image of unit vector j, i.e. column j.
+    return basis.convert(system, 'car').data.reshape(n, 3, 3).transpose(0, 2, 1)
+
+
+##############################################################################
+# The binned converter only computes the matrices at the edges of the time
+# bins the times being converted fall in, and keeps them, so converting more
+# data from the same period costs no further exact conversions. Between two
+# edges each element of the matrix is interpolated linearly. To keep memory
+# down for ten million points, the interpolated matrix is never stored: each
+# of its nine elements is formed in turn and applied to one coordinate.
+class BinnedConverter:
+    """
+    Convert GEO coordinates to another system with a transformation that is
+    computed once per time bin and interpolated within it.
+
+    Parameters
+    ----------
+    system : `str`
+        Coordinate system to convert to, e.g. ``'SM'`` or ``'GSM'``.
+    bin_size : `float`, optional
+        Width of the time bins in seconds.
+    """
+    def __init__(self, system, bin_size=60):
+        self.system = system
+        self.bin_size = bin_size
+        self.matrices = {}
+
+    def matrices_at(self, edges):
+        """Rotation matrices at bin edge numbers ``edges``, computing missing ones."""
+        missing = [edge for edge in edges if edge not in self.matrices]
+        if missing:
+            new = rotation_matrices(np.array(missing, dtype=float) * self.bin_size, self.system)
+            self.matrices.update(zip(missing, new))
+        return np.stack([self.matrices[edge] for edge in edges])
+
+    def convert(self, coords):
+        """
+        Convert Cartesian GEO ``coords`` (a `~spacepy.coordinates.Coords`
+        with ticks) to Cartesian coordinates in ``system``.
+        """
+        if coords.dtype != 'GEO' or coords.carsph != 'car':
+            raise ValueError('Coordinates must be Cartesian GEO, not {0} {1}'.format(
+                coords.dtype, coords.carsph))
+        tai = np.asarray(coords.ticks.TAI, dtype=float)
+        position = tai / self.bin_size
+        before = np.floor(position)
+        fraction = position - before
+        # Only the edges either side of the given times are needed.
+        before = before.astype(np.int64)
+        edges = np.union1d(before, before + 1)
+        index = np.searchsorted(edges, before)
+        matrices = self.matrices_at(edges.tolist())
+        data = np.atleast_2d(coords.data)
+        converted = np.zeros_like(data, dtype=float)
+        for i in range(3):
+            for j in range(3):
+                element = matrices[index, i, j]
+                element += (matrices[index + 1, i, j] - element) * fraction
+                element *= data[:, j]
+                converted[:, i] += element
+        return Coords(converted, self.system, 'car', units=coords.units, ticks=coords.ticks)
+
+
+##############################################################################
+# A trajectory
+# ------------
+# Ten million positions one second apart, about four months, on an
+# elliptical orbit between 2 and 12 Earth radii, inclined to the equator and
+# precessing slowly so that it samples all local times.
+n = 10**7
+start = spt.Ticktock('2002-02-02T12:00:00', 'ISO').TAI[0]
+tai = start + np.arange(n, dtype=float)
+t = tai - start
+anomaly = 2 * np.pi * t / (18 * 3600)
+radius = 7 / (1 + 5 / 7 * np.cos(anomaly))
+node = 2 * np.pi * t / (30 * 86400)
+inclination = np.radians(30)
+geo = np.empty((n, 3))
+geo[:, 0] = radius * (np.cos(node) * np.cos(anomaly)
+                      - np.sin(node) * np.sin(anomaly) * np.cos(inclination))
+geo[:, 1] = radius * (np.sin(node) * np.cos(anomaly)
+                      + np.cos(node) * np.sin(anomaly) * np.cos(inclination))
+geo[:, 2] = radius * np.sin(anomaly) * np.sin(inclination)
+del t, anomaly, radius, node
+coords = Coords(geo, 'GEO', 'car', ticks=spt.Ticktock(tai, 'TAI'))
+
+##############################################################################
+# Accuracy
+# --------
+# The exact conversion of all ten million points would take a long time, so
+# it is done for every 997th point, which still covers the whole four months
+# (a prime step, so that the points do not all fall on bin edges, where the
+# binned conversion is exact). The error is the distance between the exact
+# and binned positions.
+step = 997
+subset = Coords(geo[::step], 'GEO', 'car', ticks=spt.Ticktock(tai[::step], 'TAI'))
+bin_sizes = [10, 60, 300, 900]
+errors = {}
+exact_time = {}
+for system in ('SM', 'GSM'):
+    t0 = time.perf_counter()
+    exact = subset.convert(system, 'car').data
+    exact_time[system] = (time.perf_counter() - t0) * step
+    errors[system] = []
+    for bin_size in bin_sizes:
+        binned = BinnedConverter(system, bin_size).convert(subset).data
+        errors[system].append(np.max(np.linalg.norm(binned - exact, axis=1)))
+        print('{0:>4}, {1:4d} s bins: maximum error {2:.2e} Re ({3:.3f} km)'.format(
+            system, bin_size, errors[system][-1], errors[system][-1] * 6371.2))
+
+##############################################################################
+# Benchmark
+# ---------
+# Now all ten million points with one minute bins, against the time of the
+# exact conversion of the subset scaled up to ten million points.
+for system in ('SM', 'GSM'):
+    t0 = time.perf_counter()
+    converter = BinnedConverter(system, 60)
+    converter.convert(coords)
+    binned_time = time.perf_counter() - t0
+    print('{0:>4}: exact about {1:.0f} s, binned {2:.1f} s ({3:.0f}x faster, {4} exact '
+          'transformations)'.format(system, exact_time[system], binned_time,
+                                    exact_time[system] / binned_time, len(converter.matrices)))
+
+##############################################################################
+# Finally, plot the error against the bin size. The interpolation error grows
+# with the square of the bin size.
+fig, ax = plt.subplots()
+for system, error in errors.items():
+    ax.loglog(bin_sizes, np.array(error) * 6371.2, 'o-', label=system)
+ax.set_xlabel('Bin size [s]')
+ax.set_ylabel('Maximum error [km]')
+ax.legend()
+plt.show()
@@ -0,0 +1,250 @@
+# coding: utf-8
+"""
+============================================
+Fast Cutouts from a Compressed AIA FITS File
+============================================
+
+The `Downloading and Compressing a FITS file <https://heliopython.org/gallery/generated/gallery/retrieve_compress.html>`_
+example saves a deconvolved AIA image as a tile-compressed FITS file. Opening
+that file with `sunpy.map.Map` decompresses the whole 4096 x 4096 image, even
+if only a small region of it is wanted. The purpose of this example is to show
+a lazy loader that decompresses only the tiles a cutout overlaps, keeps
+recently used tiles in a cache of bounded size, and returns the cutout as a
+`~sunpy.map.GenericMap`, so that the cost of a cutout grows with its size
+rather than with the size of the full image.
+"""
+
+##############################################################################
+# First the imports
+import collections
+import os
+import time
+
+import numpy as np
+
+import astropy.units as u
+from astropy.coordinates import SkyCoord, UnitSphericalRepresentation
+from astropy.io import fits
+from astropy.wcs import WCS
+
+import sunpy.coordinates  # noqa: F401, makes astropy WCS understand helioprojective frames
+import sunpy.data.sample
+import sunpy.map
+
+##############################################################################
+# The compressed file written by the retrieve and compress example is used if
+# it is there. Otherwise the (smaller) SunPy sample AIA 171 image is
+# compressed the same way, with `~astropy.io.fits.CompImageHDU`'s default
+# tiles of one image row each, and with square tiles of 128 x 128 pixels.
+filename = 'aia_map_deconv_comp.fits'
+if not os.path.exists(filename):
+    filename = 'aia_sample_comp.fits'
+    aia_map = sunpy.map.Map(sunpy.data.sample.AIA_171_IMAGE)
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.CompImageHDU(aia_map.data.astype(np.float32), aia_map.fits_header)]
+                 ).writeto(filename, overwrite=True)
+
+square_tiles = 'aia_square_tiles_comp.fits'
+with fits.open(filename) as hdul:
+    hdu = next(hdu for hdu in hdul if isinstance(hdu, fits.CompImageHDU))
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.CompImageHDU(hdu.data, hdu.header, tile_shape=(128, 128))]
+                 ).writeto(square_tiles, overwrite=True)
+
+##############################################################################
+# The loader
+# ----------
+# A tile-compressed image is stored as a binary table with one row per tile,
+# each holding the compressed bytes of that tile, and the tile size is given
+# by the ``ZTILEn`` header keywords. `~astropy.io.fits.CompImageHDU.section`
+# only decompresses the tiles a slice overlaps, so asking it for one tile at a
+# time decompresses exactly that tile. Decompressed tiles are kept in an
+# `collections.OrderedDict` in order of use, and the least recently used ones
+# are dropped when the cache grows beyond ``max_bytes``.
+#
+# World coordinates are converted to pixels with the WCS of the image header,
+# which is read without touching the data.
+class CompressedMapLoader:
+    """
+    Read cutouts of a tile-compressed FITS image one tile at a time.
+
+    Parameters
+    ----------
+    filename : `str`
+        FITS file holding a `~astropy.io.fits.CompImageHDU`.
+    max_bytes : `int`, optional
+        Maximum size of the decompressed tiles kept in memory.
+    """
+    def __init__(self, filename, max_bytes=64 * 1024**2):
+        self.hdul = fits.open(filename)
+        index = next(i for i, hdu in enumerate(self.hdul) if isinstance(hdu, fits.CompImageHDU))
+        self.hdu = self.hdul[index]
+        self.header = self.hdu.header
+        self.shape = (self.header['NAXIS2'], self.header['NAXIS1'])
+        # The tile size is in the header of the underlying table.
+        table_header = fits.getheader(filename, index, disable_image_compression=True)
+        self.tile_shape = (table_header.get('ZTILE2', 1), table_header['ZTILE1'])
+        self.wcs = WCS(self.header)
+        self.max_bytes = max_bytes
+        self.tiles = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.hdul.close()
+
+    def tile(self, row, column):
+        """Decompressed tile ``(row, column)``, from the cache if possible."""
+        key = (row, column)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return tile
+        self.misses += 1
+        ny, nx = self.tile_shape
+        tile = self.hdu.section[row * ny:(row + 1) * ny, column * nx:(column + 1) * nx]
+        self.tiles[key] = tile
+        self.nbytes += tile.nbytes
+        while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+            self.nbytes -= self.tiles.popitem(last=False)[1].nbytes
+        return tile
+
+    def pixel_cutout(self, x0, x1, y0, y1):
+        """Data of the pixels ``x0 <= x < x1`` and ``y0 <= y < y1``."""
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), self.shape[1]), min(int(y1), self.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError('The region x = [{0}, {1}), y = [{2}, {3}) does not overlap the '
+                             '{4} x {5} image'.format(x0, x1, y0, y1, *self.shape[::-1]))
+        ny, nx = self.tile_shape
+        cutout = None
+        for row in range(y0 // ny, (y1 - 1) // ny + 1):
+            for column in range(x0 // nx, (x1 - 1) // nx + 1):
+                tile = self.tile(row, column)
+                if cutout is None:
+                    cutout = np.empty((y1 - y0, x1 - x0), dtype=tile.dtype)
+                # The part of the tile inside the cutout, in cutout and tile pixels.
+                ty0, tx0 = row * ny, column * nx
+                ya, yb = max(y0, ty0), min(y1, ty0 + tile.shape[0])
+                xa, xb = max(x0, tx0), min(x1, tx0 + tile.shape[1])
+                cutout[ya - y0:yb - y0, xa - x0:xb - x0] = tile[ya - ty0:yb - ty0, xa - tx0:xb - tx0]
+        return cutout
+
+    def pixel_range(self, bottom_left, top_right):
+        """
+        Pixel range ``x0, x1, y0, y1`` of the region between two coordinates.
+
+        Like `~sunpy.map.GenericMap.submap`, the region is the rectangle with
+        these corners in their own frame, and the range covers all four of its
+        corners, which need not be the bottom left and top right in the image.
+        """
+        top_right = top_right.transform_to(bottom_left.frame)
+        lon = [bottom_left.spherical.lon, top_right.spherical.lon] * 2
+        lat = [bottom_left.spherical.lat] * 2 + [top_right.spherical.lat] * 2
+        corners = bottom_left.frame.realize_frame(
+            UnitSphericalRepresentation(u.Quantity(lon), u.Quantity(lat)))
+        x, y = self.wcs.world_to_pixel(SkyCoord(corners))
+        if not np.all(np.isfinite(x) & np.isfinite(y)):
+            raise ValueError('Not all corners of the region can be projected onto the image')
+        x0, y0 = np.floor(np.min(x) + 0.5), np.floor(np.min(y) + 0.5)
+        x1, y1 = np.floor(np.max(x) + 0.5) + 1, np.floor(np.max(y) + 0.5) + 1
+        return (int(max(x0, 0)), int(min(x1, self.shape[1])),
+                int(max(y0, 0)), int(min(y1, self.shape[0])))
+
+    def submap(self, bottom_left, top_right):
+        """
+        Cutout between two coordinates, as a map.
+
+        Parameters
+        ----------
+        bottom_left, top_right : `~astropy.coordinates.SkyCoord`
+            Opposite corners of the region, in any frame SunPy can transform
+            to the frame of the image. The region is the rectangle with these
+            corners in the frame of ``bottom_left``.
+
+        Returns
+        -------
+        `~sunpy.map.GenericMap`
+        """
+        x0, x1, y0, y1 = self.pixel_range(bottom_left, top_right)
+        meta = self.header.copy()
+        meta['CRPIX1'] -= x0
+        meta['CRPIX2'] -= y0
+        return sunpy.map.Map(self.pixel_cutout(x0, x1, y0, y1), meta)
+
+
+##############################################################################
+# A cutout of an active region, checked against the same pixels of the fully
+# decompressed map.
+full_map = sunpy.map.Map(filename)
+bottom_left = SkyCoord(-400 * u.arcsec, -100 * u.arcsec, frame=full_map.coordinate_frame)
+top_right = SkyCoord(0 * u.arcsec, 300 * u.arcsec, frame=full_map.coordinate_frame)
+
+loader = CompressedMapLoader(filename)
+cutout = loader.submap(bottom_left, top_right)
+x0, x1, y0, y1 = loader.pixel_range(bottom_left, top_right)
+print('Same data as the full map:', np.array_equal(cutout.data, full_map.data[y0:y1, x0:x1]))
+print('Bottom left corner moved by',
+      cutout.bottom_left_coord.separation(full_map.pixel_to_world(x0 * u.pix, y0 * u.pix)))
+
+##############################################################################
+# A region that does not overlap the image is refused.
+try:
+    loader.submap(SkyCoord(3000 * u.arcsec, 3000 * u.arcsec, frame=full_map.coordinate_frame),
+                  SkyCoord(3500 * u.arcsec, 3500 * u.arcsec, frame=full_map.coordinate_frame))
+except ValueError as error:
+    print(error)
+loader.close()
+
+##############################################################################
+# Benchmark
+# ---------
+# Square cutouts of increasing size from the middle of the image, read once
+# by decompressing the whole image and then with the loader, from both files
+# and with an empty cache. With one row per tile, a cutout still decompresses
+# whole rows of the image, so its cost grows with its height; with square
+# tiles it grows with its area.
+def full_cutout(filename, x0, x1, y0, y1):
+    with fits.open(filename) as hdul:
+        data = next(hdu for hdu in hdul if isinstance(hdu, fits.CompImageHDU)).data
+        return data[y0:y1, x0:x1].copy()
+
+
+def timed(function, *args):
+    t0 = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - t0
+
+
+ny, nx = full_map.data.shape
+print('{0:>8} {1:>12} {2:>12} {3:>14}'.format('cutout', 'full [ms]', 'rows [ms]', 'square [ms]'))
+for size in (32, 128, 512, min(2048, nx, ny)):
+    box = (nx // 2 - size // 2, nx // 2 + size // 2, ny // 2 - size // 2, ny // 2 + size // 2)
+    times = []
+    for path in (filename, square_tiles):
+        expected, t_full = timed(full_cutout, path, *box)
+        loader = CompressedMapLoader(path)
+        data, elapsed = timed(loader.pixel_cutout, *box)
+        assert np.array_equal(data, expected)
+        loader.close()
+        times.append(elapsed)
+    # The full read time is about the same for both files; show the last one.
+    print('{0:>8} {1:12.1f} {2:12.1f} {3:14.1f}'.format(size, t_full * 1e3, times[0] * 1e3,
+                                                       times[1] * 1e3))
+
+##############################################################################
+# Panning across the image, as an image viewer would, reads each tile only
+# once while it stays in the cache.
+loader = CompressedMapLoader(square_tiles, max_bytes=16 * 1024**2)
+t0 = time.perf_counter()
+for x0 in range(0, nx - 256, 32):
+    loader.pixel_cutout(x0, x0 + 256, ny // 2, ny // 2 + 256)
+print('Panned in {0:.1f} ms: {1} tiles decompressed, {2} read from the cache'.format(
+    (time.perf_counter() - t0) * 1e3, loader.misses, loader.hits))
+loader.close()
+
+##############################################################################
+# Finally, plot the cutout.
+cutout.peek()
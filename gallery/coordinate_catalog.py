@@ -0,0 +1,205 @@
+# coding: utf-8
+"""
+====================================================
+Caching Name and Observatory Lookups for Offline Use
+====================================================
+
+The `Astropy Coordinates and SunPy Demo <https://heliopython.org/gallery/generated/gallery/coordinates_demo.html>`_
+looks up the Crab nebula with `~astropy.coordinates.SkyCoord.from_name` and
+the VLA with `~astropy.coordinates.EarthLocation.of_site`. Both ask a remote
+service every time they are called, which is slow, fails without a network
+connection, and does not scale to the thousands of targets of an observing
+list. The purpose of this example is to build a small persistent catalog
+that remembers every resolved name and site on disk, answers repeated lookups
+from memory in microseconds, can be pre-seeded from a file, and resolves long
+lists of names in bulk.
+"""
+
+##############################################################################
+# First the imports
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import astropy.units as u
+from astropy.coordinates import EarthLocation, SkyCoord
+from astropy.coordinates.name_resolve import NameResolveError
+from astropy.table import Table
+
+##############################################################################
+# The catalog keeps two in-memory indexes, one for sky targets (ICRS right
+# ascension and declination in degrees) and one for sites (geocentric x, y, z
+# in metres), both keyed by a normalized name so that ``'Crab'``,
+# ``'crab'`` and ``' CRAB '`` are the same entry. Anything that is not in the
+# index is resolved remotely once and written back to a JSON file, so the
+# next session (or a machine without network access that was given the file)
+# never has to ask again.
+def _normalize(name):
+    return ' '.join(name.lower().split())
+
+
+class TargetCatalog:
+    """
+    A persistent, in-memory indexed cache of resolved targets and sites.
+
+    Parameters
+    ----------
+    filename : str
+        JSON file the catalog is loaded from (if it exists) and saved to.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.targets = {}
+        self.sites = {}
+        if os.path.exists(filename):
+            with open(filename) as fobj:
+                stored = json.load(fobj)
+            self.targets = {name: tuple(radec) for name, radec in stored['targets'].items()}
+            self.sites = {name: tuple(xyz) for name, xyz in stored['sites'].items()}
+
+    def save(self):
+        """Write the catalog to disk, replacing the file atomically."""
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as fobj:
+            json.dump({'targets': self.targets, 'sites': self.sites}, fobj)
+        os.replace(tmp, self.filename)
+
+    def seed(self, filename):
+        """
+        Add targets from a table with ``name``, ``ra`` and ``dec`` columns.
+
+        Any format `~astropy.table.Table.read` understands can be used; the
+        coordinates are ICRS and, if the columns have no unit, in degrees.
+        """
+        table = Table.read(filename)
+        ra = u.Quantity(table['ra'], u.deg).value
+        dec = u.Quantity(table['dec'], u.deg).value
+        for name, this_ra, this_dec in zip(table['name'], ra, dec):
+            self.targets[_normalize(str(name))] = (float(this_ra), float(this_dec))
+        self.save()
+
+    def radec(self, name):
+        """Return the ICRS ``(ra, dec)`` of ``name`` in degrees, resolving it if needed."""
+        key = _normalize(name)
+        try:
+            return self.targets[key]
+        except KeyError:
+            coord = SkyCoord.from_name(name).icrs
+            self.targets[key] = (coord.ra.deg, coord.dec.deg)
+            self.save()
+            return self.targets[key]
+
+    def skycoord(self, name):
+        """Return ``name`` as a `~astropy.coordinates.SkyCoord`, like `~astropy.coordinates.SkyCoord.from_name`."""
+        ra, dec = self.radec(name)
+        return SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame='icrs')
+
+    def site(self, name):
+        """Return ``name`` as an `~astropy.coordinates.EarthLocation`, like `~astropy.coordinates.EarthLocation.of_site`."""
+        key = _normalize(name)
+        if key not in self.sites:
+            location = EarthLocation.of_site(name)
+            self.sites[key] = tuple(float(c.to_value(u.m)) for c in location.geocentric)
+            self.save()
+        return EarthLocation.from_geocentric(*self.sites[key], unit=u.m)
+
+    def resolve_many(self, names, max_workers=8):
+        """
+        Resolve many names at once.
+
+        Names missing from the catalog are resolved concurrently and the
+        catalog is saved once at the end, even if resolving is interrupted.
+        Names that cannot be resolved, because the service does not know them
+        or could not be reached, are returned separately rather than raising.
+
+        Returns
+        -------
+        coords : `~astropy.coordinates.SkyCoord`
+            One array coordinate for the resolved names, in input order.
+        unresolved : list of str
+            Names that could not be resolved; they are missing from ``coords``.
+        """
+        keys = [_normalize(name) for name in names]
+        missing = {key: name for key, name in zip(keys, names) if key not in self.targets}
+
+        def resolve(name):
+            try:
+                return SkyCoord.from_name(name).icrs
+            except (NameResolveError, OSError):
+                # OSError covers network failures (URLError, timeouts).
+                return None
+
+        if missing:
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    for key, coord in zip(missing, pool.map(resolve, missing.values())):
+                        if coord is not None:
+                            self.targets[key] = (coord.ra.deg, coord.dec.deg)
+            finally:
+                self.save()
+
+        found = [key for key in keys if key in self.targets]
+        radec = np.array([self.targets[key] for key in found]).reshape(-1, 2)
+        unresolved = [name for key, name in zip(keys, names) if key not in self.targets]
+        return SkyCoord(ra=radec[:, 0] * u.deg, dec=radec[:, 1] * u.deg, frame='icrs'), unresolved
+
+
+##############################################################################
+# Start a catalog and look up the Crab and the VLA as in the coordinates demo.
+# The first lookup of each goes out to the network.
+catalog = TargetCatalog('target_catalog.json')
+
+t0 = time.perf_counter()
+crab = catalog.skycoord('Crab')
+vla = catalog.site('vla')
+print('First lookup: {0:.3f} s'.format(time.perf_counter() - t0))
+print(crab)
+print(vla)
+
+##############################################################################
+# Every later lookup, in this session or the next one, is answered from the
+# in-memory index. Getting the raw coordinates back takes around a
+# microsecond; wrapping them in a `~astropy.coordinates.SkyCoord` costs more
+# than the lookup itself.
+n = 100000
+t0 = time.perf_counter()
+for _ in range(n):
+    catalog.radec('Crab')
+print('Cached (ra, dec) lookup: {0:.2f} us'.format((time.perf_counter() - t0) / n * 1e6))
+
+n = 1000
+t0 = time.perf_counter()
+for _ in range(n):
+    catalog.skycoord('crab')
+print('Cached SkyCoord lookup: {0:.1f} us'.format((time.perf_counter() - t0) / n * 1e6))
+
+##############################################################################
+# Reloading the catalog from disk, as a new session would, gives the same
+# coordinates without any network access.
+reloaded = TargetCatalog('target_catalog.json')
+print(reloaded.skycoord('CRAB').separation(crab).to(u.mas))
+
+##############################################################################
+# A catalog can be pre-seeded from a file, for example a target list
+# prepared for an observing campaign. Here we make up a list of 5000 targets
+# and write it as a CSV file.
+rng = np.random.default_rng(42)
+n_targets = 5000
+target_list = Table({'name': ['Target {0:04d}'.format(i) for i in range(n_targets)],
+                     'ra': rng.uniform(0, 360, n_targets) * u.deg,
+                     'dec': np.rad2deg(np.arcsin(rng.uniform(-1, 1, n_targets))) * u.deg})
+target_list.write('target_list.csv', overwrite=True)
+catalog.seed('target_list.csv')
+
+##############################################################################
+# Resolving the whole list returns a single array
+# `~astropy.coordinates.SkyCoord`, ready for vectorized transforms, without
+# touching the network.
+t0 = time.perf_counter()
+targets, unresolved = catalog.resolve_many(list(target_list['name']))
+elapsed = time.perf_counter() - t0
+print('Resolved {0} targets in {1:.1f} ms ({2:.2f} us per target), {3} unresolved'.format(
+    len(targets), elapsed * 1e3, elapsed / len(targets) * 1e6, len(unresolved)))
@@ -0,0 +1,139 @@
+# coding: utf-8
+"""
+==========================================
+Tracking the Sun from a Ground Observatory
+==========================================
+
+The `Astropy Coordinates and SunPy Demo <https://heliopython.org/gallery/generated/gallery/coordinates_demo.html>`_ finds the
+altitude and azimuth of the Sun from DKIST at two instants by building a new
+`~astropy.coordinates.AltAz` frame and `~astropy.coordinates.SkyCoord` for
+each one. Planning an observing run needs the same Sun → AltAz →
+Helioprojective chain at a high cadence, and repeating it one time at a time
+is slow. The purpose of this example is to show how to do the whole chain
+with a single vectorized transform per frame over an array of times, and how
+to reuse the Earth orientation and aberration terms between nearby times.
+"""
+
+##############################################################################
+# First the imports
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+import astropy.units as u
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord
+from astropy.coordinates.erfa_astrom import ErfaAstrom, ErfaAstromInterpolator, erfa_astrom
+from astropy.time import Time
+
+from sunpy.coordinates import frames
+
+##############################################################################
+# The helper below takes a (vector) `~astropy.time.Time` and an
+# `~astropy.coordinates.EarthLocation` and returns the pointing to the centre
+# of the Sun in AltAz, together with the same pointing transformed back to
+# Helioprojective coordinates as seen from the observatory. Every frame is
+# created once with the full array of times, so each step is one vectorized
+# transform.
+#
+# Most of the cost of an AltAz transform is computing the Earth orientation,
+# precession-nutation, aberration and light deflection terms for every
+# time. `~astropy.coordinates.erfa_astrom.ErfaAstromInterpolator` computes
+# them on a coarse grid (``support_spacing``) and interpolates in between,
+# which is accurate to well below a milliarcsecond for spacings of minutes.
+def sun_pointing(times, location, support_spacing=5 * u.min):
+    """
+    Pointing to the centre of the Sun from ``location`` at every time in ``times``.
+
+    Parameters
+    ----------
+    times : `~astropy.time.Time`
+        Array of observation times.
+    location : `~astropy.coordinates.EarthLocation`
+        Location of the observatory.
+    support_spacing : `~astropy.units.Quantity`, optional
+        Spacing of the grid on which the Earth orientation and aberration
+        terms are computed. `None` computes them exactly at every time.
+
+    Returns
+    -------
+    altaz : `~astropy.coordinates.SkyCoord`
+        The Sun in the `~astropy.coordinates.AltAz` frame of ``location``.
+    helioprojective : `~astropy.coordinates.SkyCoord`
+        ``altaz`` transformed back into Helioprojective coordinates for an
+        observer at ``location``.
+    """
+    observer = location.get_itrs(times)
+    hpc_frame = frames.Helioprojective(obstime=times, observer=observer)
+    altaz_frame = AltAz(obstime=times, location=location)
+    sun = SkyCoord(np.zeros(times.shape) * u.arcsec, np.zeros(times.shape) * u.arcsec,
+                   distance=hpc_frame.observer.radius, frame=hpc_frame)
+    astrom = ErfaAstrom() if support_spacing is None else ErfaAstromInterpolator(support_spacing)
+    with erfa_astrom.set(astrom):
+        altaz = sun.transform_to(altaz_frame)
+        helioprojective = altaz.transform_to(hpc_frame)
+    return altaz, helioprojective
+
+
+##############################################################################
+# The distance given to the Sun centre is the distance of the observer from
+# the Sun (``observer.radius``); without it the transforms could not account
+# for the parallax of the Sun between the observatory and the centre of the
+# Earth.
+#
+# Let's track the Sun from DKIST at a 1 second cadence over the day of the
+# coordinates demo (local midnight to midnight).
+dkist = EarthLocation(lat=20.70818*u.deg, lon=-156.2569*u.deg, height=3084*u.m)
+utcoffset = -10 * u.hour
+start = Time('2018-11-14 00:00:00') - utcoffset
+times = start + np.arange(0, 24 * 3600, 1) * u.s
+
+t0 = time.perf_counter()
+sun_altaz, sun_hpc = sun_pointing(times, dkist)
+batched = time.perf_counter() - t0
+print('Batched: {0} times in {1:.2f} s'.format(times.size, batched))
+
+##############################################################################
+# The Helioprojective coordinates should come back as the centre of the Sun.
+offset = np.hypot(sun_hpc.Tx, sun_hpc.Ty).to(u.mas)
+print('Largest round-trip offset from Sun centre: {0:.3f}'.format(offset.max()))
+
+##############################################################################
+# Compare this against the approach of the coordinates demo, building a new
+# `~astropy.coordinates.AltAz` frame and `~astropy.coordinates.SkyCoord` for
+# every instant. A few hundred instants are enough to estimate the cost per
+# time.
+n_loop = 200
+t0 = time.perf_counter()
+loop_altaz = []
+for this_time in times[:n_loop]:
+    this_frame = frames.Helioprojective(obstime=this_time, observer=dkist.get_itrs(this_time))
+    this_sun = SkyCoord(0 * u.arcsec, 0 * u.arcsec, distance=this_frame.observer.radius,
+                        frame=this_frame)
+    loop_altaz.append(this_sun.transform_to(AltAz(obstime=this_time, location=dkist)))
+looped = (time.perf_counter() - t0) / n_loop
+print('Loop: {0:.2f} ms per time, about {1:.0f} s for the whole day '
+      '({2:.0f}x slower than batched)'.format(looped * 1e3, looped * times.size,
+                                              looped * times.size / batched))
+
+##############################################################################
+# The interpolated Earth orientation and aberration terms agree with the
+# exact, per-time calculation to far better than the seeing.
+loop_alt = u.Quantity([c.alt for c in loop_altaz])
+loop_az = u.Quantity([c.az for c in loop_altaz])
+print('Largest difference from the loop: alt {0:.3f}, az {1:.3f}'.format(
+    np.abs(sun_altaz.alt[:n_loop] - loop_alt).max().to(u.mas),
+    np.abs((sun_altaz.az[:n_loop] - loop_az).wrap_at(180 * u.deg)).max().to(u.mas)))
+
+##############################################################################
+# For a whole observing season, feed the helper one day (or a few hours) at a
+# time so that the arrays stay a manageable size; the cost per time is the
+# same. Finally, plot the altitude of the Sun over the day.
+hours = (times - start).to(u.hour)
+fig, ax = plt.subplots()
+ax.plot(hours, sun_altaz.alt.to(u.deg))
+ax.axhline(0, color='k', linestyle='--')
+ax.set_xlabel('Hours after local midnight (HST)')
+ax.set_ylabel('Altitude of the Sun [deg]')
+ax.set_title('The Sun from DKIST on 2018-11-14')
+plt.show()
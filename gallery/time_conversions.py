@@ -0,0 +1,218 @@
+# coding: utf-8
+"""
+===========================================================
+Converting Time Arrays Between pytplot, SpacePy and Astropy
+===========================================================
+
+The examples in this gallery hold times in several ways: pytplot stores
+seconds since 1970 (see the `pyspedas Demo <https://heliopython.org/gallery/generated/gallery/pyspedas_demo.html>`_),
+the `SpacePy coordinates example <https://heliopython.org/gallery/generated/gallery/coordinate_systems.html>`_
+builds a `~spacepy.time.Ticktock` from ISO strings, and the SunPy examples use
+`~astropy.time.Time`. Going from one to another through strings, or one
+element at a time, is slow for long time series. The purpose of this example
+is to show a small set of conversion functions that move whole arrays of
+times between these representations with vectorized arithmetic and a cached
+table of leap seconds.
+"""
+
+##############################################################################
+# First the imports
+import functools
+import time
+
+import erfa
+import numpy as np
+
+from astropy.time import Time, update_leap_seconds
+import spacepy.time as spt
+
+##############################################################################
+# The times involved
+# ------------------
+# * pytplot: seconds since 1970-01-01 UTC, ignoring leap seconds (POSIX or
+#   "unix" time), as floats.
+# * SpacePy: `~spacepy.time.Ticktock` can be built from, and gives, ``TAI``:
+#   seconds since 1958-01-01 *including* leap seconds.
+# * Astropy: `~astropy.time.Time` stores a two-part Julian date, which for a
+#   UTC time without leap seconds is just the unix time in days plus a
+#   constant.
+# * Strings and `numpy.datetime64`: NumPy parses ISO strings into 64-bit
+#   integers (nanoseconds since 1970, no leap seconds) in compiled code.
+#
+# The only part that is not a fixed offset is the number of leap seconds,
+# TAI - UTC, which changes on the dates in the leap second table. That table
+# is read once (Astropy keeps it up to date) and turned into the unix and TAI
+# times at which each change takes effect, so looking up any number of times
+# is a single `numpy.searchsorted`. Only times from 1972, when leap seconds
+# were introduced, are supported; earlier times raise a `ValueError`.
+UNIX_TO_TAI1958 = 378691200  # seconds from 1958-01-01 to 1970-01-01, no leap seconds
+UNIX_EPOCH_JD = 2440587.5
+NS = 1000000000
+
+
+@functools.lru_cache()
+def leap_second_table():
+    """
+    Return the start of each leap second period and its TAI - UTC.
+
+    Returns
+    -------
+    unix, tai, tai_minus_utc : `numpy.ndarray`
+        Start of each period as unix time and as SpacePy TAI, and the number
+        of seconds TAI is ahead of UTC during it.
+    """
+    update_leap_seconds()
+    table = erfa.leap_seconds.get()
+    table = table[table['year'] >= 1972]
+    starts = np.array(['{0:04d}-{1:02d}-01'.format(year, month)
+                       for year, month in zip(table['year'], table['month'])], dtype='datetime64[s]')
+    unix = starts.astype(np.int64)
+    tai_minus_utc = np.round(table['tai_utc']).astype(np.int64)
+    return unix, unix + UNIX_TO_TAI1958 + tai_minus_utc, tai_minus_utc
+
+
+def _leap_second_index(starts, times):
+    """Index of the leap second period of each time, refusing times before 1972."""
+    index = np.searchsorted(starts, times, side='right') - 1
+    if np.any(index < 0):
+        raise ValueError('Times before 1972-01-01 are not supported')
+    return index
+
+
+def unix_to_tai(unix):
+    """
+    Unix seconds (pytplot) to seconds since 1958 including leap seconds (SpacePy TAI).
+    Raises `ValueError` for times before 1972.
+    """
+    starts, _, tai_minus_utc = leap_second_table()
+    unix = np.asarray(unix, dtype=float)
+    index = _leap_second_index(starts, unix)
+    return unix + (UNIX_TO_TAI1958 + tai_minus_utc[index])
+
+
+def tai_to_unix(tai):
+    """
+    SpacePy TAI to unix seconds. A leap second maps onto the second after it.
+    Raises `ValueError` for times before 1972.
+    """
+    _, starts, tai_minus_utc = leap_second_table()
+    tai = np.asarray(tai, dtype=float)
+    index = _leap_second_index(starts, tai)
+    return tai - (UNIX_TO_TAI1958 + tai_minus_utc[index])
+
+
+def unix_to_datetime64(unix):
+    """Unix seconds to `numpy.datetime64` with nanosecond resolution."""
+    unix = np.asarray(unix, dtype=float)
+    seconds = np.floor(unix)
+    nanoseconds = np.round((unix - seconds) * NS).astype(np.int64)
+    return (seconds.astype(np.int64) * NS + nanoseconds).view('datetime64[ns]')
+
+
+def datetime64_to_unix(times):
+    """`numpy.datetime64` to unix seconds."""
+    nanoseconds = np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+    seconds, nanoseconds = np.divmod(nanoseconds, NS)
+    return seconds + nanoseconds / NS
+
+
+def iso_to_unix(strings):
+    """ISO 8601 strings (e.g. ``'2002-02-02T12:00:00'``) to unix seconds."""
+    return datetime64_to_unix(np.asarray(strings, dtype='datetime64[ns]'))
+
+
+def unix_to_iso(unix):
+    """Unix seconds to ISO 8601 strings with microsecond precision."""
+    return np.datetime_as_string(unix_to_datetime64(unix), unit='us')
+
+
+def unix_to_astropy(unix):
+    """Unix seconds to a UTC `~astropy.time.Time`, splitting whole days and fractions exactly."""
+    days, seconds = np.divmod(np.asarray(unix, dtype=float), 86400)
+    return Time(UNIX_EPOCH_JD + days, seconds / 86400, format='jd', scale='utc')
+
+
+def astropy_to_unix(times):
+    """`~astropy.time.Time` to unix seconds."""
+    utc = times.utc
+    return (utc.jd1 - UNIX_EPOCH_JD) * 86400 + utc.jd2 * 86400
+
+
+def unix_to_ticktock(unix):
+    """Unix seconds to a `~spacepy.time.Ticktock`, without going through strings."""
+    return spt.Ticktock(unix_to_tai(unix), 'TAI')
+
+
+def ticktock_to_unix(ticks):
+    """`~spacepy.time.Ticktock` to unix seconds."""
+    return tai_to_unix(ticks.TAI)
+
+
+##############################################################################
+# Checking against the libraries
+# ------------------------------
+# Convert a few times spread over the leap seconds since 1972 with the
+# functions above and with the libraries' own (slower) conversions.
+check = np.linspace(iso_to_unix('1972-01-01T00:00:00'), iso_to_unix('2023-01-01T00:00:00'), 1000)
+tai_lib = spt.Ticktock(unix_to_iso(check).tolist(), 'ISO').TAI
+print('TAI vs SpacePy:        {0:.1e} s'.format(np.max(np.abs(unix_to_tai(check) - tai_lib))))
+print('unix from TAI:         {0:.1e} s'.format(np.max(np.abs(tai_to_unix(tai_lib) - check))))
+print('Astropy vs Time.unix:  {0:.1e} s'.format(
+    np.max(np.abs(unix_to_astropy(check).unix - check))))
+print('Time.unix vs Astropy:  {0:.1e} s'.format(
+    np.max(np.abs(astropy_to_unix(Time(check, format='unix')) - check))))
+print('ISO round trip:        {0:.1e} s'.format(np.max(np.abs(iso_to_unix(unix_to_iso(check)) - check))))
+
+##############################################################################
+# Times before 1972 are refused rather than given a wrong offset.
+try:
+    unix_to_tai(iso_to_unix(['1969-07-20T20:17:40', '2002-02-02T12:00:00']))
+except ValueError as error:
+    print(error)
+
+##############################################################################
+# Benchmark
+# ---------
+# Ten million times at a 1 second cadence, about four months of data. Ten
+# million ISO strings would take about a gigabyte of memory, so conversions
+# to and from strings are timed on one million times, and the libraries'
+# string parsers on a hundred thousand; all times are scaled to ten million.
+n = 10**7
+n_strings = 10**6
+n_parser = 10**5
+unix = iso_to_unix('2015-12-31T00:00:00') + np.arange(n, dtype=float)
+
+
+def timed(function, *args):
+    t0 = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - t0
+
+
+iso, t_iso = timed(unix_to_iso, unix[:n_strings])
+_, t_parse = timed(iso_to_unix, iso)
+_, t_astropy_str = timed(lambda s: Time(s, format='isot', scale='utc'), iso[:n_parser].tolist())
+_, t_ticktock_str = timed(lambda s: spt.Ticktock(s, 'ISO').TAI, iso[:n_parser].tolist())
+del iso
+tai, t_tai = timed(unix_to_tai, unix)
+_, t_unix = timed(tai_to_unix, tai)
+_, t_ticktock = timed(lambda u: unix_to_ticktock(u).TAI, unix)
+astropy_times, t_to_astropy = timed(unix_to_astropy, unix)
+_, t_time_unix = timed(lambda u: Time(u, format='unix'), unix)
+_, t_from_astropy = timed(astropy_to_unix, astropy_times)
+
+rows = [
+    ('unix -> ISO strings', t_iso * n / n_strings),
+    ('ISO strings -> unix', t_parse * n / n_strings),
+    ('ISO strings -> Time (Time parser)', t_astropy_str * n / n_parser),
+    ('ISO strings -> Ticktock TAI (Ticktock parser)', t_ticktock_str * n / n_parser),
+    ('unix -> SpacePy TAI', t_tai),
+    ('SpacePy TAI -> unix', t_unix),
+    ('unix -> Ticktock -> TAI', t_ticktock),
+    ('unix -> Time (two-part JD)', t_to_astropy),
+    ("unix -> Time (format='unix')", t_time_unix),
+    ('Time -> unix', t_from_astropy),
+]
+print('Time to convert {0:.0e} elements:'.format(n))
+for label, seconds in rows:
+    print('{0:>46}: {1:8.2f} s'.format(label, seconds))
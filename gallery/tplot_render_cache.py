@@ -0,0 +1,224 @@
+# coding: utf-8
+"""
+========================================
+Restyling tplot Panels Without Redrawing
+========================================
+
+The `PyTplot Demo <https://heliopython.org/gallery/generated/gallery/pytplot_demo.html>`_
+calls `pytplot.tplot` about half a dozen times on the same variables, and
+most of the calls only change the styling: line thickness, titles, log axes
+or time bars. Each call rebuilds every panel from the raw arrays. The purpose
+of this example is to show a small matplotlib renderer for tplot variables
+that keeps the prepared data of each panel (times converted for plotting,
+log-scaled spectrograms and series decimated to the screen resolution), and
+only restyles the existing figure when nothing but the style has changed.
+"""
+
+##############################################################################
+# First the imports, and the sample tplot file used in the PyTplot demo.
+import time
+import urllib.request
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+
+import pytplot
+
+url = 'https://github.com/MAVENSDC/PyTplot/raw/master/docs/test_data.tplot'
+urllib.request.urlretrieve(url, "./test_data.tplot")
+pytplot.tplot_restore('test_data.tplot')
+
+##############################################################################
+# Preparing a panel
+# -----------------
+# tplot times are seconds since 1970, and matplotlib dates are days since
+# 1970, so converting the time axis is a single vectorized division.
+# Series with more samples than there are pixels across the figure are
+# reduced to the minimum and maximum in each pixel column, which looks the
+# same on screen; spectrograms are averaged into pixel columns. These are the
+# expensive steps, and they only depend on the data, the ``zlog`` option
+# (spectrograms are stored already log-scaled) and the figure width.
+EPOCH = mdates.date2num(np.datetime64('1970-01-01T00:00:00'))
+
+
+def decimate(x, y, n_columns):
+    """Reduce ``y`` to its minimum and maximum in ``n_columns`` equal runs of samples."""
+    if len(x) <= 2 * n_columns:
+        return x, y
+    edges = np.linspace(0, len(x), n_columns + 1).astype(int)
+    x = np.column_stack([x[edges[:-1]], x[edges[1:] - 1]]).ravel()
+    y = np.stack([np.fmin.reduceat(y, edges[:-1], axis=0),
+                  np.fmax.reduceat(y, edges[:-1], axis=0)], axis=1)
+    return x, y.reshape((-1,) + y.shape[2:])
+
+
+def bin_average(x, z, n_columns):
+    """Average the rows of ``z`` (ignoring NaNs) in ``n_columns`` equal runs of samples."""
+    if len(x) <= 2 * n_columns:
+        return x, z
+    edges = np.linspace(0, len(x), n_columns + 1).astype(int)[:-1]
+    finite = np.isfinite(z)
+    with np.errstate(invalid='ignore'):
+        z = (np.add.reduceat(np.where(finite, z, 0), edges)
+             / np.add.reduceat(finite.astype(int), edges))
+    return np.add.reduceat(x, edges) / np.diff(np.append(edges, len(x))), z
+
+
+def plot_options(name):
+    return pytplot.data_quants[name].attrs['plot_options']
+
+
+def prepare_panel(name, zlog, n_columns):
+    """Everything needed to draw ``name`` that depends on its data."""
+    data = pytplot.get_data(name)
+    x = np.asarray(data[0]) / 86400 + EPOCH
+    if plot_options(name)['extras'].get('spec'):
+        bins = data[2][0] if np.ndim(data[2]) > 1 else data[2]
+        z = np.asarray(data[1], dtype=float)
+        if zlog:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                z = np.where(z > 0, np.log10(z), np.nan)
+        x, z = bin_average(x, z, n_columns)
+        return {'kind': 'spec', 'x': x, 'bins': bins, 'z': z.T}
+    x, y = decimate(x, np.asarray(data[1], dtype=float), n_columns)
+    return {'kind': 'line', 'x': x, 'y': y}
+
+
+##############################################################################
+# The renderer
+# ------------
+# Prepared panels are cached per variable, together with the
+# `xarray.DataArray` they were prepared from (`pytplot.store_data` replaces
+# that object, `pytplot.options` only changes its attributes) and the options
+# that change the prepared data. If the figure from the previous call is
+# still open and shows the same variables, the existing artists are kept and
+# only restyled. Otherwise a new figure is drawn, still from the cached
+# prepared data.
+class TplotRenderer:
+    """
+    Draw tplot variables with matplotlib, caching prepared panel data.
+
+    Parameters
+    ----------
+    n_columns : int, optional
+        Number of pixel columns data is reduced to.
+    """
+    def __init__(self, n_columns=1000):
+        self.n_columns = n_columns
+        self.prepared = {}
+        self.fig = None
+        self.names = None
+        self.artists = {}
+
+    def panel(self, name):
+        """Return the prepared data of ``name`` and whether it was (re)prepared."""
+        quant = pytplot.data_quants[name]
+        data_options = (plot_options(name)['zaxis_opt'].get('z_axis_type') == 'log', self.n_columns)
+        cached = self.prepared.get(name)
+        if cached is not None and cached[0] is quant and cached[1] == data_options:
+            return cached[2], False
+        prepared = prepare_panel(name, data_options[0], self.n_columns)
+        self.prepared[name] = (quant, data_options, prepared)
+        return prepared, True
+
+    def tplot(self, names):
+        """Draw (or restyle) ``names``, one panel each, like `pytplot.tplot`."""
+        names = [names] if isinstance(names, str) else list(names)
+        reuse = (self.fig is not None and plt.fignum_exists(self.fig.number)
+                 and names == self.names)
+        if not reuse:
+            size = pytplot.tplot_opt_glob.get('window_size', [800, 800])
+            self.fig, axes = plt.subplots(len(names), 1, sharex=True, squeeze=False,
+                                          figsize=(size[0] / 100, size[1] / 100))
+            self.names = names
+            self.artists = {name: {'ax': ax, 'data': None, 'timebars': []}
+                            for name, ax in zip(names, axes[:, 0])}
+        for name in names:
+            prepared, changed = self.panel(name)
+            if changed or not reuse:
+                self._draw(name, prepared)
+            self._style(name, prepared)
+        self.fig.suptitle(pytplot.tplot_opt_glob.get('title_text', ''))
+        return self.fig
+
+    def _draw(self, name, prepared):
+        artists = self.artists[name]
+        ax = artists['ax']
+        for artist in artists['data'] or []:
+            artist.remove()
+        if prepared['kind'] == 'spec':
+            artists['data'] = [ax.pcolormesh(prepared['x'], prepared['bins'], prepared['z'],
+                                             shading='nearest')]
+        else:
+            artists['data'] = ax.plot(prepared['x'], prepared['y'])
+        ax.xaxis_date()
+
+    def _style(self, name, prepared):
+        options = plot_options(name)
+        artists = self.artists[name]
+        ax = artists['ax']
+        yaxis = options['yaxis_opt']
+        ax.set_ylabel(yaxis.get('axis_label', name))
+        ax.set_yscale('log' if yaxis.get('y_axis_type') == 'log' else 'linear')
+        if yaxis.get('y_range') is not None:
+            ax.set_ylim(*yaxis['y_range'][:2])
+        if prepared['kind'] == 'line':
+            for line in artists['data']:
+                line.set_linewidth(options['line_opt'].get('line_width', 1))
+        for timebar in artists['timebars']:
+            timebar.remove()
+        artists['timebars'] = [
+            ax.axvline(bar['location'] / 86400 + EPOCH, color=bar.get('line_color', 'k'),
+                       linewidth=bar.get('line_width', 1))
+            for bar in options.get('time_bar', []) if bar.get('dimension', 'height') == 'height']
+
+
+##############################################################################
+# Replaying the demo
+# ------------------
+# These are the `pytplot.tplot` calls of the PyTplot demo and the options set
+# between them. The crosshair options only affect the interactive viewer, so
+# here they are style-only changes with nothing to draw.
+def replay(reuse):
+    """Replay the demo, with a new renderer for every call unless ``reuse``."""
+    steps = [
+        (lambda: pytplot.options('swia_vel', 'thick', 4), 'swia_vel'),
+        (lambda: pytplot.options('swia_vel', 'ytitle', 'speed (km/s)'), 'swia_vel'),
+        (lambda: pytplot.tplot_options('title', 'All Plots'), ['swia_counts', 'swia_vel', 'mag']),
+        (lambda: pytplot.tplot_options('crosshair', False), ['swia_counts', 'swia_vel', 'mag']),
+        (lambda: pytplot.timebar('2016-06-20 01:15:32', thick=3, color='green'),
+         ['swia_counts', 'swia_vel', 'mag']),
+        (lambda: pytplot.options('swia_counts', 'ylog', 1), ['swia_counts', 'swia_vel', 'mag']),
+        (lambda: pytplot.options('swia_counts', 'zlog', 1), ['swia_counts', 'swia_vel', 'mag']),
+    ]
+    renderer = TplotRenderer()
+    t0 = time.perf_counter()
+    for set_option, names in steps:
+        set_option()
+        if not reuse:
+            renderer = TplotRenderer()
+        fig = renderer.tplot(names)
+        fig.canvas.draw()
+    elapsed = time.perf_counter() - t0
+    # Only keep the final figure open.
+    for number in plt.get_fignums():
+        if number != fig.number:
+            plt.close(number)
+    return elapsed, fig
+
+
+##############################################################################
+# First with a fresh renderer for every call, which rebuilds every panel
+# from the raw data just like `pytplot.tplot` does, then, starting again from
+# the same options, with one renderer that is reused. Only the ``zlog`` step
+# changes prepared data (the spectrogram), so every other step just restyles.
+uncached, _ = replay(reuse=False)
+plt.close('all')
+pytplot.del_data()
+pytplot.tplot_restore('test_data.tplot')
+pytplot.tplot_options('title', '')
+cached, fig = replay(reuse=True)
+print('Rebuilding every call: {0:.2f} s, restyling: {1:.2f} s ({2:.1f}x faster)'.format(
+    uncached, cached, uncached / cached))
+plt.show()
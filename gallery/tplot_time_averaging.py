@@ -0,0 +1,156 @@
+# coding: utf-8
+"""
+======================================
+Fast Time Averages of Spectrogram Data
+======================================
+
+The `PyTplot Demo <https://heliopython.org/gallery/generated/gallery/pytplot_demo.html>`_
+sets the ``t_average`` and ``static_tavg`` options on the ``swia_counts``
+spectrogram. Each time such an average is needed it is computed from the
+full spectrogram again, which costs time proportional to the number of
+samples in the window times the number of energy bins. The purpose of this
+example is to show how cumulative sums, computed once per variable, answer
+any time average with two row lookups, so that moving the averaging window
+around (as the interactive plot does under the mouse) costs only as much as
+the number of bins.
+"""
+
+##############################################################################
+# First the imports, and the sample tplot file used in the PyTplot demo.
+import time
+import urllib.request
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+import pytplot
+
+url = 'https://github.com/MAVENSDC/PyTplot/raw/master/docs/test_data.tplot'
+urllib.request.urlretrieve(url, "./test_data.tplot")
+pytplot.tplot_restore('test_data.tplot')
+
+##############################################################################
+# The averaging engine. ``cumsum[i]`` holds the sum of the first ``i`` rows of
+# the spectrogram (NaNs, i.e. fill values, count as zero) and ``count[i]`` how
+# many of them were finite, so the mean over rows ``i`` to ``j`` is
+# ``(cumsum[j] - cumsum[i]) / (count[j] - count[i])``. Finding ``i`` and ``j``
+# for a time interval is a binary search in the sorted times.
+class TimeAverager:
+    """
+    Time averages of a spectrogram from prefix sums.
+
+    Parameters
+    ----------
+    times : `numpy.ndarray`
+        Sorted sample times, shape ``(n_samples,)``.
+    values : `numpy.ndarray`
+        Spectrogram, shape ``(n_samples, n_bins)``.
+    """
+    def __init__(self, times, values):
+        self.times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        finite = np.isfinite(values)
+        n_bins = values.shape[1]
+        self.cumsum = np.zeros((len(self.times) + 1, n_bins))
+        np.cumsum(np.where(finite, values, 0), axis=0, out=self.cumsum[1:])
+        self.count = np.zeros((len(self.times) + 1, n_bins), dtype=np.int64)
+        np.cumsum(finite, axis=0, out=self.count[1:])
+
+    def interval_average(self, start, end):
+        """Mean spectrum of the samples with ``start <= time <= end``, like ``static_tavg``."""
+        i = np.searchsorted(self.times, start, side='left')
+        j = np.searchsorted(self.times, end, side='right')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.cumsum[j] - self.cumsum[i]) / (self.count[j] - self.count[i])
+
+    def window_average(self, center, width):
+        """Mean spectrum over ``width`` seconds centred on ``center``, like ``t_average``."""
+        return self.interval_average(center - width / 2, center + width / 2)
+
+    def running_average(self, width):
+        """The ``window_average`` centred on every sample time."""
+        start = np.searchsorted(self.times, self.times - width / 2, side='left')
+        end = np.searchsorted(self.times, self.times + width / 2, side='right')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.cumsum[end] - self.cumsum[start]) / (self.count[end] - self.count[start])
+
+
+##############################################################################
+# The prefix sums only need to be rebuilt when the data changes. pytplot
+# keeps each variable as an `xarray.DataArray` in ``pytplot.data_quants`` and
+# `pytplot.store_data` replaces that object, whereas `pytplot.options` only
+# changes its attributes. Keeping one averager per variable, tagged with the
+# object it was built from, therefore keeps it valid across any number of
+# ``options(...)`` calls and rebuilds it after new data is stored.
+_averagers = {}
+
+
+def averager_for(name):
+    """Return the `TimeAverager` of the tplot variable ``name``, building it if the data changed."""
+    quant = pytplot.data_quants[name]
+    cached = _averagers.get(name)
+    if cached is None or cached[0] is not quant:
+        data = pytplot.get_data(name)
+        cached = _averagers[name] = (quant, TimeAverager(data[0], data[1]))
+    return cached[1]
+
+
+def unix_time(string):
+    """Seconds since 1970 (the time used by pytplot) for an ISO time string."""
+    return np.datetime64(string.replace(' ', 'T'), 'ns').astype(np.int64) / 1e9
+
+
+##############################################################################
+# Set the same options as in the PyTplot demo. The averager is built once, and
+# setting more options does not invalidate it.
+pytplot.options('swia_counts', 'static_tavg', ['2016-06-20 12:00:00', '2016-06-20 13:00:00'])
+pytplot.options('swia_counts', 't_average', 1200)
+
+t0 = time.perf_counter()
+averager = averager_for('swia_counts')
+print('Prefix sums built in {0:.1f} ms'.format((time.perf_counter() - t0) * 1e3))
+
+pytplot.options('swia_counts', 'zlog', 1)
+print('Still valid after options():', averager_for('swia_counts') is averager)
+
+##############################################################################
+# The ``static_tavg`` spectrum, compared with averaging the rows directly.
+times, counts, energies = pytplot.get_data('swia_counts')[:3]
+start, end = unix_time('2016-06-20 12:00:00'), unix_time('2016-06-20 13:00:00')
+static_tavg = averager.interval_average(start, end)
+in_interval = (times >= start) & (times <= end)
+direct = np.nanmean(counts[in_interval], axis=0)
+print('Same as the direct mean:', np.allclose(static_tavg, direct, equal_nan=True))
+
+##############################################################################
+# The interactive plot recomputes the ``t_average`` window every time the
+# mouse moves. Time 1000 such windows both ways.
+centers = np.linspace(times[0], times[-1], 1000)
+width = 1200
+
+t0 = time.perf_counter()
+for center in centers:
+    averager.window_average(center, width)
+prefix = time.perf_counter() - t0
+
+t0 = time.perf_counter()
+with np.errstate(invalid='ignore'):
+    for center in centers:
+        window = (times >= center - width / 2) & (times <= center + width / 2)
+        np.nanmean(counts[window], axis=0)
+naive = time.perf_counter() - t0
+print('{0} windows: prefix sums {1:.1f} ms, direct {2:.1f} ms ({3:.0f}x faster)'.format(
+    len(centers), prefix * 1e3, naive * 1e3, naive / prefix))
+
+##############################################################################
+# Finally, plot the static average and the 20 minute average at the time of
+# the ``static`` option of the demo.
+energy = energies[0] if np.ndim(energies) > 1 else energies
+fig, ax = plt.subplots()
+ax.loglog(energy, static_tavg, label='static_tavg 12:00-13:00')
+ax.loglog(energy, averager.window_average(unix_time('2016-06-20 01:00:57'), width),
+          label='t_average 1200 s at 01:00:57')
+ax.set_xlabel('Energy [eV]')
+ax.set_ylabel('Counts')
+ax.legend()
+plt.show()
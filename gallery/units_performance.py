@@ -0,0 +1,160 @@
+# coding: utf-8
+"""
+=============================================
+Fast Unit Handling for Large Arrays and Loops
+=============================================
+
+The `Quantities, Units, and Constants <https://heliopython.org/gallery/generated/gallery/units_demo.html>`_
+demo shows how `~astropy.units.Quantity` and
+`~astropy.units.quantity_input` keep a calculation like the plasma beta
+correct. On large arrays, or in a function called many times in a loop, the
+unit bookkeeping of every intermediate result (and the copies it makes) can
+cost more than the arithmetic itself. The purpose of this example is to show
+how to check and convert units once, at the boundary of a function, and run
+its body on plain NumPy arrays without copying the data.
+"""
+
+##############################################################################
+# First the imports
+import functools
+import inspect
+import time
+import tracemalloc
+
+import numpy as np
+
+from astropy import constants as astropy_const
+from astropy import units as u
+
+##############################################################################
+# The ``<<`` operator attaches or converts a unit. If the value already has
+# the requested unit, ``value << unit`` is a view of the same memory, so no
+# data is copied; only a value in a different (but compatible) unit has to be
+# converted, and that is done in a single pass. ``.view(np.ndarray)`` then
+# gives the raw array, again without a copy.
+#
+# The decorator below uses this to convert each argument to the unit given
+# for it, raise `~astropy.units.UnitConversionError` if it cannot be, call
+# the function with raw arrays, and attach ``result`` to what it returns.
+def quantity_boundary(result=None, **units):
+    """
+    Convert the arguments of a function to fixed units and strip them.
+
+    Parameters
+    ----------
+    result : `~astropy.units.UnitBase`, optional
+        Unit attached (as a view) to the value returned by the function.
+    **units : `~astropy.units.UnitBase`
+        Unit each named argument is converted to before the call.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            for name, unit in units.items():
+                value = bound.arguments[name]
+                if value is None and signature.parameters[name].default is None:
+                    # An optional argument left out, as quantity_input allows.
+                    continue
+                if not isinstance(value, u.Quantity):
+                    raise TypeError("Argument '{0}' to function '{1}' has no unit; "
+                                    "expected {2}.".format(name, function.__name__, unit))
+                bound.arguments[name] = (value << unit).view(np.ndarray)
+            value = function(*bound.args, **bound.kwargs)
+            return value if result is None else value << result
+        return wrapper
+    return decorator
+
+
+##############################################################################
+# Here is the plasma beta from the units demo, written three ways: with
+# quantities throughout, with `~astropy.units.quantity_input`, and with the
+# boundary decorator. In the last one the body works in SI units on plain
+# arrays, so the constants are plain numbers too, and the arithmetic can be
+# done in place so that the result is the only new array.
+def plasma_beta(n, T, B):
+    return (2 * n * astropy_const.k_B * T) / (B ** 2 / (2 * astropy_const.mu0))
+
+
+@u.quantity_input
+def plasma_beta_checked(n: u.m**-3, T: u.K, B: u.T) -> u.dimensionless_unscaled:
+    return ((2 * n * astropy_const.k_B * T) / (B ** 2 / (2 * astropy_const.mu0))).decompose()
+
+
+K_B = astropy_const.k_B.si.value
+MU0 = astropy_const.mu0.si.value
+
+
+@quantity_boundary(n=u.m**-3, T=u.K, B=u.T, result=u.dimensionless_unscaled)
+def plasma_beta_fast(n, T, B):
+    beta = np.multiply(n, T)
+    beta *= 4 * MU0 * K_B
+    beta /= B
+    beta /= B
+    return beta
+
+
+##############################################################################
+# All three agree for the solar corona.
+corona = (1e9 * u.cm**-3, 3e6 * u.K, 10 * u.Gauss)
+print(plasma_beta(*corona).decompose())
+print(plasma_beta_checked(*corona))
+print(plasma_beta_fast(*corona))
+
+##############################################################################
+# Wrong units are still caught, before any work is done.
+try:
+    plasma_beta_fast(1e9 * u.cm**-3, 3e6 * u.K, 10 * u.m)
+except u.UnitConversionError as error:
+    print(error)
+
+##############################################################################
+# First, the overhead of a single call with scalar inputs, as in a tight
+# loop. Most of the cost of the quantity versions is creating and checking
+# the intermediate quantities.
+def per_call(function, args, n=2000):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        function(*args)
+    return (time.perf_counter() - t0) / n
+
+
+si = (1e15 * u.m**-3, 3e6 * u.K, 1e-3 * u.T)
+for function in (plasma_beta, plasma_beta_checked, plasma_beta_fast):
+    print('{0:>20}: {1:6.1f} us per call'.format(function.__name__, per_call(function, si) * 1e6))
+
+##############################################################################
+# Now the run time and peak memory for arrays of increasing size, with the
+# inputs already in SI units. Peak memory is what was allocated on top of
+# the inputs, measured with `tracemalloc` (NumPy reports its allocations to
+# it), and is shown in units of the size of one input array. Set
+# ``max_exponent`` to 8 to reach 10⁸ elements; the three inputs alone then
+# take 2.4 GB.
+max_exponent = 7
+
+
+def run(function, args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+rng = np.random.default_rng(0)
+print('{0:>10} {1:>20} {2:>10} {3:>12}'.format('size', 'function', 'time [s]', 'peak/input'))
+for exponent in range(3, max_exponent + 1):
+    size = 10**exponent
+    args = (rng.uniform(1e14, 1e16, size) << u.m**-3,
+            rng.uniform(1e6, 1e7, size) << u.K,
+            rng.uniform(1e-4, 1e-2, size) << u.T)
+    for function in (plasma_beta, plasma_beta_checked, plasma_beta_fast):
+        elapsed, peak = run(function, args)
+        print('{0:>10} {1:>20} {2:10.4f} {3:12.1f}'.format(size, function.__name__, elapsed,
+                                                           peak / args[0].nbytes))
+    del args